@@ -1,12 +1,23 @@
 import configparser
+import io
 import json
+import logging
+import os
+import threading
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Dict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 CONFIG_FILE = 'data/config.ini'
 
+logger = logging.getLogger('Config')
+
 
-@dataclass
+@dataclass(frozen=True)
 class ConfigItem:
     section: str
     name: str
@@ -16,7 +27,7 @@ class ConfigItem:
     need_restart: bool = False
 
 
-DEFAULT_CONFIG = [
+DEFAULT_CONFIG = (
     ConfigItem(
         'SSH', 'tasks_count', 'ssh_tasks_count', 50,
         "Số thread check fresh SSH"),
@@ -58,12 +69,21 @@ DEFAULT_CONFIG = [
         'SSHSTORE', 'country', 'sshstore_country', 'All',
         "Quốc gia lấy SSH từ SSHSTORE"
     ),
-]
+)
+
+
+def _loads(value: str):
+    if orjson is not None:
+        return orjson.loads(value)
+    return json.loads(value)
+
 
 PYDANTIC_ARGS = {}
 for i in DEFAULT_CONFIG:
     PYDANTIC_ARGS[i.full_name] = (type(i.value), i.value)
 
+_BY_FULL_NAME = {i.full_name: i for i in DEFAULT_CONFIG}
+
 
 def get_default_config():
     config = configparser.ConfigParser()
@@ -74,32 +94,120 @@ def get_default_config():
     return config
 
 
+def _render_config(config) -> str:
+    buffer = io.StringIO()
+    config.write(buffer)
+    return buffer.getvalue()
+
+
+_DEFAULT_INI_TEXT = _render_config(get_default_config())
+
+
+_cache = {'stat': None, 'config': None, 'values': None}
+_cache_lock = threading.Lock()
+
+
+def _get_config_stat():
+    try:
+        stat = os.stat(CONFIG_FILE)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _invalidate_cache():
+    _cache['stat'] = None
+    _cache['config'] = None
+    _cache['values'] = None
+
+
+def _decode_values(config) -> Dict[str, Any]:
+    values = {}
+    for item in DEFAULT_CONFIG:
+        try:
+            values[item.full_name] = _loads(config.get(item.section, item.name))
+        except (configparser.Error, ValueError) as exc:
+            logger.warning(f"Config {repr(item.full_name)} is invalid, using default value "
+                           f"{repr(item.value)} - {type(exc).__name__}: {exc}")
+            values[item.full_name] = item.value
+    return values
+
+
+def _load():
+    with _cache_lock:
+        stat = _get_config_stat()
+        if stat is None or stat != _cache['stat']:
+            config = configparser.ConfigParser()
+            config.read(CONFIG_FILE)
+            if not config.sections():
+                config = configparser.ConfigParser()
+                config.read_string(_DEFAULT_INI_TEXT)
+                _write_text(_DEFAULT_INI_TEXT)
+                stat = _get_config_stat()
+
+            _cache['stat'] = stat
+            _cache['config'] = config
+            _cache['values'] = _decode_values(config)
+        return _cache['config'], _cache['values']
+
+
 def get_config():
+    """
+    Get a copy of the parsed config. The parsed config is cached and only re-read
+    when the config file is changed, so changes to the copy only take effect
+    after passing it to write_config.
+
+    :return: Parsed config
+    """
     config = configparser.ConfigParser()
-    config.read(CONFIG_FILE)
-    if not config.sections():
-        config = get_default_config()
-        write_config(config)
+    config.read_dict(_load()[0])
     return config
 
 
 def get(full_name: str):
-    for item in DEFAULT_CONFIG:
-        if item.full_name == full_name:
-            return get_by_item(item)
-    raise RuntimeError(f"Config {repr(full_name)} not found")
+    try:
+        item = _BY_FULL_NAME[full_name]
+    except KeyError:
+        raise RuntimeError(f"Config {repr(full_name)} not found") from None
+    return get_by_item(item)
 
 
 def get_by_item(item: ConfigItem):
-    config = get_config()
-    value = config.get(item.section, item.name)
-    return json.loads(value)
+    return _load()[1][item.full_name]
+
+
+def _write_text(text: str):
+    # Write to a temporary file then swap it in, so readers never see a partially written config
+    temp_file = f'{CONFIG_FILE}.tmp'
+    with open(temp_file, 'w') as file:
+        file.write(text)
+    os.replace(temp_file, CONFIG_FILE)
 
 
 def write_config(config):
-    with open(CONFIG_FILE, 'w+') as file:
-        config.write(file)
+    text = _render_config(config)
+    with _cache_lock:
+        _write_text(text)
+        _invalidate_cache()
+
+
+def write_values(values: Dict[str, Any]):
+    """
+    Write config values, keyed by their full names. Missing values keep their
+    current value.
+
+    :param values: Config values
+    """
+    current_values = _load()[1]
+    config = configparser.ConfigParser()
+    for item in DEFAULT_CONFIG:
+        if item.section not in config.sections():
+            config.add_section(item.section)
+        config[item.section][item.name] = json.dumps(values.get(item.full_name, current_values[item.full_name]))
+    write_config(config)
 
 
 def reset_config():
-    write_config(get_default_config())
+    with _cache_lock:
+        _write_text(_DEFAULT_INI_TEXT)
+        _invalidate_cache()
@@ -54,12 +54,14 @@ async def reset_ports(ports: List[Port], unique=True, delete_ssh=False):
     for the same Port
     :param delete_ssh: Set to True to delete all used SSHs
     """
-    tasks = []
+    port_numbers = []
+    reconnecting = []
 
     with db_session:
         for port in ports:
             # Disconnect SSH from port
             port = Port[port.id]  # Load port.ssh
+            port_numbers.append(port.port_number)
             used_ssh = port.ssh
             port.disconnect_ssh(used_ssh)
             if delete_ssh:
@@ -69,9 +71,12 @@ async def reset_ports(ports: List[Port], unique=True, delete_ssh=False):
             ssh = SSH.get_ssh_for_port(port, unique=unique)
             if ssh:
                 port.assign_ssh(ssh)
-                tasks.append(asyncio.create_task(reconnect_port_using_ssh(port, ssh)))
+                reconnecting.append((port, ssh))
 
-    await asyncio.gather(*tasks)
+    # Tear down old proxies of all ports at once before reconnecting
+    await ssh_controllers.kill_proxies_on_ports(port_numbers)
+
+    await asyncio.gather(*[reconnect_port_using_ssh(port, ssh) for port, ssh in reconnecting])
 
 
 def reset_entities_data():
@@ -3,56 +3,37 @@ import logging
 import time
 from dataclasses import dataclass
 from functools import cache
-from typing import List
+from typing import Dict, List, Optional
 
 import asyncssh
-import asyncssh.compression
-import asyncssh.encryption
-import asyncssh.kex
-import asyncssh.mac
+import asyncssh.public_key
 
+import config
 import utils
+from controllers import ssh_pool
 from utils import get_proxy_ip
 
 logger = logging.getLogger('Ssh')
 
 
+# Mimic JSCH config (also compatible with old dropbear and OpenSSH 7.2 servers)
+ALGS_CONFIG = dict(
+    kex_algs=['ecdh-sha2-nistp256', 'ecdh-sha2-nistp384', 'ecdh-sha2-nistp521', 'diffie-hellman-group14-sha1',
+              'diffie-hellman-group-exchange-sha256', 'diffie-hellman-group-exchange-sha1',
+              'diffie-hellman-group1-sha1'],
+    server_host_key_algs=['ssh-rsa', 'ssh-dss', 'ecdsa-sha2-nistp256', 'ecdsa-sha2-nistp384', 'ecdsa-sha2-nistp521'],
+    encryption_algs=['aes128-ctr', 'aes128-cbc', '3des-cbc', 'blowfish-cbc', 'aes192-ctr', 'aes192-cbc',
+                     'aes256-ctr', 'aes256-cbc'],
+    mac_algs=['hmac-md5', 'hmac-sha1', 'hmac-sha2-256', 'hmac-sha1-96', 'hmac-md5-96'],
+    compression_algs=['none'],
+)
+
+
 @cache
 def get_algs_config():
-    algs_config = dict(server_host_key_algs=[b'ssh-rsa'],  # Old dropbear servers compatibility
-                       kex_algs=asyncssh.kex.get_kex_algs(),
-                       encryption_algs=asyncssh.encryption.get_encryption_algs(),
-                       mac_algs=asyncssh.mac.get_mac_algs(),
-                       compression_algs=asyncssh.compression.get_compression_algs(),
-                       signature_algs=(asyncssh.public_key.get_x509_certificate_algs() +
-                                       asyncssh.public_key.get_public_key_algs()))
-
-    # OpenSSH 7.2 compatibility
-    if b'ecdh-sha2-nistp521' in algs_config['kex_algs']:
-        algs_config['kex_algs'].remove(b'ecdh-sha2-nistp521')
-
-    # Reverse order of kex_algs to prefer less secure algorithms
-    algs_config['kex_algs'] = algs_config['kex_algs'][::-1]
-
-    # Mimic JSCH config
-    algs_config['kex_algs'] = (b'ecdh-sha2-nistp256,ecdh-sha2-nistp384,ecdh-sha2-nistp521,diffie-hellman-group14-sha1,'
-                               b'diffie-hellman-group-exchange-sha256,diffie-hellman-group-exchange-sha1,'
-                               b'diffie-hellman-group1-sha1'
-                               .split(b','))
-    algs_config['server_host_key_algs'] = (b'ssh-rsa,ssh-dss,ecdsa-sha2-nistp256,ecdsa-sha2-nistp384,'
-                                           b'ecdsa-sha2-nistp521'
-                                           .split(b','))
-    algs_config['encryption_algs'] = (b'aes128-ctr,aes128-cbc,3des-ctr,3des-cbc,blowfish-cbc,aes192-ctr,'
-                                      b'aes192-cbc,aes256-ctr,aes256-cbc'
-                                      .replace(b'3des-ctr', b'')
-                                      .split(b','))
-    algs_config['mac_algs'] = b'hmac-md5,hmac-sha1,hmac-sha2-256,hmac-sha1-96,hmac-md5-96'.split(b',')
-    algs_config['compression_algs'] = b'none'.split(b',')
-
-    for key, algs in algs_config.items():
-        algs_config[key] = [alg.decode() for alg in algs if alg]
-
-    return algs_config
+    signature_algs = (asyncssh.public_key.get_x509_certificate_algs() +
+                      asyncssh.public_key.get_public_key_algs())
+    return dict(ALGS_CONFIG, signature_algs=[alg.decode() for alg in signature_algs])
 
 
 @dataclass
@@ -61,13 +42,33 @@ class ProxyInfo:
     connection: asyncssh.SSHClientConnection
     host: str = 'localhost'
     proxy_type: str = 'socks5'
+    listener: asyncssh.SSHListener = None
+    pooled: ssh_pool.PooledConnection = None
 
     @property
     def address(self):
         return f"{self.proxy_type}://{self.host}:{self.port}"
 
 
-proxies: List[ProxyInfo] = []
+proxies: Dict[int, ProxyInfo] = {}
+
+
+_connect_sem: Optional[asyncio.Semaphore] = None
+_connect_sem_size = 0
+
+
+def _get_connect_sem() -> asyncio.Semaphore:
+    """
+    Get the semaphore limiting concurrent SSH handshakes, so bursts of checks
+    are queued instead of hitting servers' connection-rate limits. It is rebuilt
+    when ssh_tasks_count is changed in the settings.
+    """
+    global _connect_sem, _connect_sem_size
+    size = config.get('ssh_tasks_count')
+    if _connect_sem is None or size != _connect_sem_size:
+        _connect_sem = asyncio.Semaphore(size)
+        _connect_sem_size = size
+    return _connect_sem
 
 
 class SSHError(Exception):
@@ -84,47 +85,64 @@ async def connect_ssh(host: str, username: str, password: str, port: int = None,
     :param host: SSH host
     :param username: SSH username
     :param password: SSH password
-    :param port: Local port to forward to
+    :param port: Local port to forward to (default: any free port)
     :param ssh_port: SSH port (default: 22)
     :param retry: Number of retries (default: 3)
     :return: ProxyInfo object containing the forwarded Socks5 proxy
     """
-    if not port:
-        port = utils.get_free_port()
-
-    try:
-        await kill_proxy_on_port(port)
-    except SSHError:
-        pass
+    if port:
+        try:
+            await kill_proxy_on_port(port)
+        except SSHError:
+            pass
+    else:
+        # Forward to port 0 to let the OS pick a free port while listening
+        port = 0
 
     start_time = time.time()
-    ssh_info = f"{host:15} | {port:5}"
+    ssh_info = f"{host:15} | {port or '':5}"
 
     def run_time():
         return '{:4.1f}'.format(time.time() - start_time)
 
+    key = ssh_pool.make_key(host, ssh_port, username, password)
+    if proxy_info := await _forward_on_pooled_connection(key, port):
+        logger.debug(f"{ssh_info} ({run_time()}s) - Connected successfully using pooled connection.")
+        proxies[proxy_info.port] = proxy_info
+        return proxy_info
+
     try:
-        try:
-            connection: asyncssh.SSHClientConnection = await asyncssh.connect(
-                host, username=username, password=password, port=ssh_port,
-                preferred_auth='password', known_hosts=None, **get_algs_config(),
-                connect_timeout='30s', config=None
-            )
-
-            await connection.forward_socks('', port)
-            proxy_info = ProxyInfo(port=port, connection=connection)
-
-            if not await get_proxy_ip(proxy_info.address):
-                await utils.kill_ssh_connection(connection)
-                raise SSHError("Cannot connect to forwarded proxy.")
-        except OSError as exc:
-            if retry > 0:
+        for attempt in range(retry + 1):
+            if attempt:
                 logger.info(f"{ssh_info} | Retrying... ({run_time()}s)")
-                return await connect_ssh(host, username, password, port, ssh_port, retry - 1)
-            else:
-                raise SSHError(f"{type(exc).__name__}: {exc}.")
-        except (asyncssh.Error, asyncio.TimeoutError) as exc:
-            raise SSHError(f"{type(exc).__name__}: {exc}.")
+
+            connection = None
+            try:
+                async with _get_connect_sem():
+                    connection: asyncssh.SSHClientConnection = await asyncssh.connect(
+                        host, username=username, password=password, port=ssh_port,
+                        preferred_auth='password', known_hosts=None, **get_algs_config(),
+                        connect_timeout='30s', keepalive_interval=30, keepalive_count_max=3, config=None
+                    )
+
+                    listener = await connection.forward_socks('', port)
+                proxy_info = ProxyInfo(port=listener.get_port(), connection=connection, listener=listener)
+
+                if not await get_proxy_ip(proxy_info.address):
+                    await utils.kill_ssh_connection(connection)
+                    raise SSHError("Cannot connect to forwarded proxy.")
+            except OSError as exc:
+                if connection is not None:
+                    connection.close()
+                error = exc
+                continue
+            except (asyncssh.Error, asyncio.TimeoutError) as exc:
+                if connection is not None:
+                    connection.close()
+                raise SSHError(f"{type(exc).__name__}: {exc}.") from exc
+            break
+        else:
+            raise SSHError(f"{type(error).__name__}: {error}.") from error
 
     except SSHError as exc:
         logger.debug(f"{ssh_info} ({run_time()}s) - {exc}")
@@ -133,10 +151,66 @@ async def connect_ssh(host: str, username: str, password: str, port: int = None,
     else:
         logger.debug(f"{ssh_info} ({run_time()}s) - Connected successfully.")
 
-    proxies.append(proxy_info)
+    proxy_info.pooled = ssh_pool.add(key, connection)
+    proxies[proxy_info.port] = proxy_info
+    return proxy_info
+
+
+async def _forward_on_pooled_connection(key: ssh_pool.PoolKey, port: int) -> Optional[ProxyInfo]:
+    """
+    Forward a Socks5 proxy through the pooled connection of given SSH, which is
+    either used by other proxies or left idle by verify_ssh.
+
+    :param key: SSH pool key
+    :param port: Local port to forward to, 0 for any free port
+    :return: ProxyInfo object on success, None if there is no working pooled connection
+    """
+    if (pooled := await ssh_pool.acquire(key)) is None:
+        return None
+
+    proxy_info = ProxyInfo(port=port, connection=pooled.connection, pooled=pooled)
+    try:
+        proxy_info.listener = await pooled.connection.forward_socks('', port)
+        proxy_info.port = proxy_info.listener.get_port()
+        is_working = bool(await get_proxy_ip(proxy_info.address))
+    except OSError:
+        # Cannot listen on the local port, the connection itself is fine
+        await _close_proxy(proxy_info)
+        return None
+    except asyncssh.Error:
+        is_working = False
+    except asyncio.CancelledError:
+        await _close_proxy(proxy_info)
+        raise
+
+    if not is_working:
+        # The pooled connection is probably dead, stop reusing it
+        ssh_pool.discard(pooled)
+        await _close_proxy(proxy_info)
+        return None
+
     return proxy_info
 
 
+async def _close_proxy(proxy_info: ProxyInfo, keep_connection: bool = True):
+    """
+    Stop forwarding the proxy, closing its connection unless it stays in the pool.
+
+    :param proxy_info: Proxy to close
+    :param keep_connection: Keep the connection in the pool for reuse. Set to False to close it once no
+                            other proxy uses it, cutting the streams still open through the proxy
+    """
+    if proxy_info.listener is not None:
+        proxy_info.listener.close()
+
+    if (pooled := proxy_info.pooled) is not None:
+        if not keep_connection and pooled.users == 1:
+            ssh_pool.discard(pooled)
+        await ssh_pool.release(pooled)
+    else:
+        await utils.kill_ssh_connection(proxy_info.connection)
+
+
 async def verify_ssh(host: str, username: str, password: str, ssh_port: int = 22) -> bool:
     """
     Verify if SSH is usable.
@@ -147,12 +221,50 @@ async def verify_ssh(host: str, username: str, password: str, ssh_port: int = 22
     :param ssh_port: SSH port (default: 22)
     :return: True if SSH is connected successfully, returns False otherwise
     """
-    try:
-        proxy_info = await connect_ssh(host, username, password, ssh_port=ssh_port)
-        await utils.kill_ssh_connection(proxy_info.connection)
+    key = ssh_pool.make_key(host, ssh_port, username, password)
+    async with ssh_pool.get_lock(key):
+        # Reuse the connection from previous check or from proxies of this SSH,
+        # skipping TCP handshake, key exchange and authentication
+        if pooled := await ssh_pool.acquire(key):
+            try:
+                is_live = await _test_forwarding(pooled.connection)
+            except (OSError, asyncssh.Error):
+                is_live = False
+            except asyncio.CancelledError:
+                await ssh_pool.release(pooled)
+                raise
+
+            if not is_live:
+                # The pooled connection may be stale, verify again using a new connection
+                ssh_pool.discard(pooled)
+            await ssh_pool.release(pooled)
+            if is_live:
+                return True
+
+        try:
+            proxy_info = await connect_ssh(host, username, password, ssh_port=ssh_port)
+        except SSHError:
+            return False
+
+        # Only the forwarded proxy is closed, the connection is kept in the pool for later checks
+        proxies.pop(proxy_info.port, None)
+        await _close_proxy(proxy_info)
         return True
-    except SSHError:
-        return False
+
+
+async def _test_forwarding(connection: asyncssh.SSHClientConnection) -> bool:
+    """
+    Test if an established SSH connection can still forward traffic.
+
+    :param connection: SSH connection
+    :return: True if the forwarded proxy works, returns False otherwise
+    """
+    listener = await connection.forward_socks('', 0)
+    try:
+        proxy_info = ProxyInfo(port=listener.get_port(), connection=connection, listener=listener)
+        return bool(await get_proxy_ip(proxy_info.address))
+    finally:
+        listener.close()
 
 
 async def kill_proxy_on_port(port: int):
@@ -161,13 +273,22 @@ async def kill_proxy_on_port(port: int):
 
     :param port: Target port number
     """
-    for proxy in proxies:
-        if proxy.port == port:
-            proxies.remove(proxy)
-            await utils.kill_ssh_connection(proxy.connection)
-            break
-    else:
+    proxy = proxies.pop(port, None)
+    if proxy is None:
         raise SSHError(f"No proxy on port {port} found.")
+    await _close_proxy(proxy, keep_connection=False)
+
+
+async def kill_proxies_on_ports(ports: List[int]):
+    """
+    Kill proxies on specified port numbers concurrently. Ports without proxy are
+    ignored.
+
+    :param ports: Target port numbers
+    """
+    closing = [proxies.pop(port) for port in ports if port in proxies]
+    await asyncio.gather(*(_close_proxy(proxy, keep_connection=False) for proxy in closing),
+                         return_exceptions=True)
 
 
 if __name__ == '__main__':
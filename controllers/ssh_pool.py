@@ -0,0 +1,154 @@
+import asyncio
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import asyncssh
+
+import utils
+
+PoolKey = Tuple[str, int, str, str]
+
+MAX_IDLE_CONNECTIONS = 256
+IDLE_TIMEOUT = 180
+
+
+@dataclass
+class PooledConnection:
+    key: PoolKey
+    connection: asyncssh.SSHClientConnection
+    users: int = 0
+
+
+# Each SSH has at most one pooled connection, either in use by some proxies or idle waiting to be reused
+_in_use: Dict[PoolKey, PooledConnection] = {}
+_idle: Dict[PoolKey, Tuple[asyncssh.SSHClientConnection, float]] = {}
+_sweeper: Optional[asyncio.Task] = None
+
+# Locks are only kept while someone holds them, so keys of SSH never pooled are not kept forever
+_locks: 'weakref.WeakValueDictionary[PoolKey, asyncio.Lock]' = weakref.WeakValueDictionary()
+
+
+def make_key(host: str, ssh_port: int, username: str, password: str) -> PoolKey:
+    """
+    Build the pool key of an SSH.
+
+    :param host: SSH host
+    :param ssh_port: SSH port
+    :param username: SSH username
+    :param password: SSH password
+    :return: Pool key
+    """
+    return host, ssh_port, username, password
+
+
+def get_lock(key: PoolKey) -> asyncio.Lock:
+    """
+    Get the lock guarding connections of given key. Each key has its own lock so
+    checks on different SSH never wait for each other.
+
+    :param key: Pool key
+    :return: Lock of the key
+    """
+    lock = _locks.get(key)
+    if lock is None:
+        lock = _locks[key] = asyncio.Lock()
+    return lock
+
+
+def _pop_expired():
+    expired_time = time.monotonic() - IDLE_TIMEOUT
+    expired = [key for key, (_, released_time) in _idle.items() if released_time <= expired_time]
+    return [_idle.pop(key)[0] for key in expired]
+
+
+async def _sweep_idle():
+    """
+    Close idle connections as soon as they expire, until no idle connection is
+    left, so they do not stay logged in when checks stop.
+    """
+    while _idle:
+        oldest_time = min(released_time for _, released_time in _idle.values())
+        await asyncio.sleep(max(oldest_time + IDLE_TIMEOUT - time.monotonic(), 0))
+        await utils.kill_ssh_connections(_pop_expired())
+
+
+def _start_sweeper():
+    global _sweeper
+    if _sweeper is None or _sweeper.done():
+        _sweeper = asyncio.create_task(_sweep_idle())
+
+
+async def acquire(key: PoolKey) -> Optional[PooledConnection]:
+    """
+    Start using the pooled connection of given key, shared with its other users.
+
+    :param key: Pool key
+    :return: Pooled connection, None if there is no usable one
+    """
+    if (pooled := _in_use.get(key)) is not None:
+        pooled.users += 1
+        return pooled
+
+    if (idle := _idle.pop(key, None)) is None:
+        return None
+
+    connection, released_time = idle
+    if released_time < time.monotonic() - IDLE_TIMEOUT:
+        await utils.kill_ssh_connection(connection)
+        return None
+
+    pooled = _in_use[key] = PooledConnection(key, connection, users=1)
+    return pooled
+
+
+def add(key: PoolKey, connection: asyncssh.SSHClientConnection) -> PooledConnection:
+    """
+    Start using a newly opened connection. It is shared with later users unless
+    the key already has a pooled connection.
+
+    :param key: Pool key
+    :param connection: Opened connection
+    :return: Pooled connection
+    """
+    pooled = PooledConnection(key, connection, users=1)
+    if key not in _in_use:
+        _in_use[key] = pooled
+    return pooled
+
+
+def discard(pooled: PooledConnection):
+    """
+    Stop sharing a connection that seems broken. Its current users may keep
+    using it, and it is closed once all of them release it.
+
+    :param pooled: Pooled connection
+    """
+    if _in_use.get(pooled.key) is pooled:
+        del _in_use[pooled.key]
+
+
+async def release(pooled: PooledConnection):
+    """
+    Stop using a pooled connection. Once it has no users left, it is kept idle
+    for later reuse, or closed if it was discarded or the pool is already full.
+
+    :param pooled: Pooled connection
+    """
+    pooled.users -= 1
+    if pooled.users > 0:
+        return
+
+    closing = _pop_expired()
+    if _in_use.get(pooled.key) is pooled:
+        del _in_use[pooled.key]
+        if pooled.key not in _idle and len(_idle) < MAX_IDLE_CONNECTIONS:
+            _idle[pooled.key] = (pooled.connection, time.monotonic())
+            _start_sweeper()
+        else:
+            closing.append(pooled.connection)
+    else:
+        closing.append(pooled.connection)
+
+    await utils.kill_ssh_connections(closing)
@@ -1,18 +1,23 @@
-import asyncio
 import typing
 from datetime import datetime
 
 from pony.orm import Optional, Required, Set, composite_key
 
 import utils
-from models import db
+from models import db, writer
 from models.common import auto_renew_objects
 
+# Parent methods bound once, instead of resolving super() on every call
+_entity_load = db.Entity.load
+
 
 class Model(db.Entity):
     last_checked = Optional(datetime)
     last_modified = Required(datetime, default=datetime.now)
 
+    # Whether check results may be written with raw SQL, skipping before_update
+    _raw_check_result_update_ = False
+
     def before_update(self):
         self.last_modified = datetime.now()
 
@@ -21,7 +26,7 @@ class Model(db.Entity):
         self.set(**kwargs, last_checked=datetime.now())
 
     async def update_check_result(self, **kwargs):
-        return await asyncio.to_thread(self._update_check_result, **kwargs)
+        return await writer.update_check_result(self, **kwargs)
 
     @auto_renew_objects
     def reset_status(self):
@@ -32,10 +37,13 @@ class Model(db.Entity):
 
     @auto_renew_objects
     def load(self):
-        super().load()
+        _entity_load(self)
         return self
 
 
+_model_before_update = Model.before_update
+
+
 class SSH(Model):
     """
     Store SSH information.
@@ -51,8 +59,11 @@ class SSH(Model):
     port = Optional('Port')
     used_ports: Set = Set('Port')
 
+    # Check results never change the port, so before_update only has to touch last_modified
+    _raw_check_result_update_ = True
+
     def before_update(self):
-        super().before_update()
+        _model_before_update(self)
 
         # Update used ports
         if self.port is not None and self.port not in self.used_ports:
@@ -71,7 +82,10 @@ class SSH(Model):
         """
         query = cls.select(lambda s: s.is_live)
         if unique:
-            query = query.filter(lambda s: s.id not in port.used_ssh_list.id)
+            # Pass used SSH IDs as literal parameters, instead of a subquery on the link table
+            used_ids = [ssh.id for ssh in port.used_ssh_list]
+            if used_ids:
+                query = query.filter(lambda s: s.id not in used_ids)
 
         if result := query.random(1):
             return result[0]
@@ -109,7 +123,7 @@ class Port(Model):
     proxy_address = Optional(str)
 
     def before_update(self):
-        super().before_update()
+        _model_before_update(self)
 
         # Update time connected
         if self.is_connected:
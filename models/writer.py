@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pony.orm import db_session
+
+from models import db
+
+logger = logging.getLogger('Writer')
+
+BATCH_SIZE = 100
+
+WriteItem = Tuple[Any, Dict[str, Any], asyncio.Future]
+
+# Every check result is written by this single thread, so SQLite sessions never compete with each other
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+_queue: Optional[asyncio.Queue] = None
+_worker: Optional[asyncio.Task] = None
+
+
+def _execute_raw_update(entity, names: Tuple[str, ...], items: List[WriteItem]):
+    """
+    Update check results of many objects with a single executemany, bypassing
+    Pony's per-object change tracking.
+
+    The statement uses SQLite's ``?`` placeholders, so this only works while
+    ``DB_ENGINE`` is ``'sqlite'``.
+    """
+    provider = db.provider
+    attrs = [getattr(entity, name) for name in names + ('last_checked', 'last_modified')]
+    assignments = ', '.join(f'{provider.quote_name(attr.column)} = ?' for attr in attrs)
+    sql = (f'UPDATE {provider.quote_name(entity._root_._table_)} SET {assignments} '
+           f'WHERE {provider.quote_name(entity._pk_.column)} = ?')
+
+    rows = []
+    for obj, kwargs, _ in items:
+        # Each row gets its own timestamp, so last_modified still tells the changes apart
+        now = datetime.now()
+        values = [kwargs[name] for name in names] + [now, now]
+        rows.append([attr.converters[0].py2sql(value) if value is not None else None
+                     for attr, value in zip(attrs, values)] + [obj.id])
+
+    db.get_connection().cursor().executemany(sql, rows)
+
+
+def _write_batch(batch: List[WriteItem]):
+    results: List[Any] = [None] * len(batch)
+    raw_updates = defaultdict(list)
+
+    with db_session(optimistic=False):
+        for index, (obj, kwargs, _) in enumerate(batch):
+            entity = type(obj)
+            if entity._raw_check_result_update_:
+                raw_updates[entity, tuple(sorted(kwargs))].append(index)
+                continue
+
+            try:
+                results[index] = (obj._update_check_result(**kwargs), None)
+            except Exception as exc:
+                results[index] = (None, exc)
+
+        for (entity, names), indexes in raw_updates.items():
+            try:
+                _execute_raw_update(entity, names, [batch[index] for index in indexes])
+                result = (None, None)
+            except Exception as exc:
+                result = (None, exc)
+            for index in indexes:
+                results[index] = result
+
+    return results
+
+
+async def _run_worker():
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _queue.get()]
+        while len(batch) < BATCH_SIZE and not _queue.empty():
+            batch.append(_queue.get_nowait())
+
+        try:
+            results = await loop.run_in_executor(_executor, _write_batch, batch)
+        except Exception as exc:
+            # The whole session failed to commit
+            logger.exception("Failed to write check results")
+            results = [(None, exc)] * len(batch)
+
+        for (_, _, future), (result, exc) in zip(batch, results):
+            if future.done():
+                continue
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+
+async def update_check_result(obj, **kwargs):
+    """
+    Queue the check result update of an object, writing it together with other
+    queued updates in one db_session.
+
+    :param obj: Updating object
+    :param kwargs: Updating attributes
+    :return: Result of the object's _update_check_result
+    """
+    global _queue, _worker
+    if _worker is None or _worker.done():
+        _queue = asyncio.Queue()
+        _worker = asyncio.create_task(_run_worker())
+
+    future = asyncio.get_running_loop().create_future()
+    await _queue.put((obj, kwargs, future))
+    return await future
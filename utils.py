@@ -1,7 +1,10 @@
+import asyncio
 import json
 import logging
 import os.path
 import socket
+import time
+from typing import List
 
 import aiohttp
 import asyncssh
@@ -9,23 +12,22 @@ import pyparsing as pp
 from aiohttp_socks import ProxyConnector
 
 
-def get_ipv4_address():
-    """
-    Get this machine's local IPv4 address
-    :return: IP address in LAN
-    """
-    hostname = socket.gethostname()
-    return socket.gethostbyname(hostname)
+IPV4_ADDRESS_TTL = 60
+_ipv4_address_cache = {'value': None, 'expiry': 0.0}
 
 
-def get_free_port():
+def get_ipv4_address():
     """
-    Get _run_with_reset_is_working free port in local machine
-    :return: Port number
+    Get this machine's local IPv4 address. The address is cached for
+    IPV4_ADDRESS_TTL seconds.
+    :return: IP address in LAN
     """
-    sock = socket.socket()
-    sock.bind(('', 0))
-    return sock.getsockname()[1]
+    now = time.monotonic()
+    if _ipv4_address_cache['value'] is None or now >= _ipv4_address_cache['expiry']:
+        hostname = socket.gethostname()
+        _ipv4_address_cache['value'] = socket.gethostbyname(hostname)
+        _ipv4_address_cache['expiry'] = now + IPV4_ADDRESS_TTL
+    return _ipv4_address_cache['value']
 
 
 def parse_ssh_file(file_content):
@@ -94,6 +96,16 @@ async def kill_ssh_connection(connection: asyncssh.SSHClientConnection):
     await connection.__aexit__(None, None, None)
 
 
+async def kill_ssh_connections(connections: List[asyncssh.SSHClientConnection]):
+    """
+    Kill multiple SSH connections concurrently.
+
+    :param connections: SSH connections
+    """
+    await asyncio.gather(*(kill_ssh_connection(connection) for connection in connections),
+                         return_exceptions=True)
+
+
 def configure_logging():
     """
     Configure console logging and file logging.
@@ -1,4 +1,3 @@
-import json
 from typing import Dict
 
 from fastapi.routing import APIRouter
@@ -31,7 +30,7 @@ def update_settings(settings: SettingsInOut):
 
     :return:
     """
-    conf = config.get_config()
+    values = {}
     need_restart = False
 
     for item in config.DEFAULT_CONFIG:
@@ -40,9 +39,9 @@ def update_settings(settings: SettingsInOut):
         if new != old and item.need_restart:
             need_restart = True
 
-        conf[item.section][item.name] = json.dumps(new)
+        values[item.full_name] = new
 
-    config.write_config(conf)
+    config.write_values(values)
 
     return SettingsUpdateResult(need_restart=need_restart)
 